@@ -8,7 +8,7 @@ import pandas as pd
 import time
 import os
 import matplotlib.pyplot as plt
-from scipy import integrate, stats
+from scipy import integrate, ndimage
 import seaborn as sns
 from typing import List, Tuple, Union
 import matplotlib.style as st
@@ -24,6 +24,154 @@ Intervals = List[Tuple[float, float]]
 Events = np.ndarray
 
 
+# maximum number of samples gathered at once by batch perievent analyses
+_BATCH_SIZE = 2**22
+
+# scalar perievent results computed by batch perievent analyses
+_PERIEVENT_STATS = [
+    "sampling_rate",
+    "preAVG_dF",
+    "postAVG_dF",
+    "preAVG_Z",
+    "postAVG_Z",
+    "preAVG_RZ",
+    "postAVG_RZ",
+    "pre_raw_AUC",
+    "post_raw_AUC",
+    "preAUC",
+    "postAUC",
+    "preZ_AUC",
+    "postZ_AUC",
+    "preRZ_AUC",
+    "postRZ_AUC",
+]
+
+
+def _nearest(time_array: np.ndarray, targets, latest: bool = False) -> np.ndarray:
+    """Find indices of the timestamps nearest to the targets.
+
+    :param time_array: sorted array of timestamps
+    :param targets: timestamp or array of timestamps to locate
+    :param latest: on ties, return the latest sample instead of the earliest
+    """
+    targets = np.asarray(targets, dtype=float)
+    if len(time_array) < 2:
+        # a single timestamp is the nearest to any target
+        return np.zeros(targets.shape, dtype=int)
+    idx = np.clip(np.searchsorted(time_array, targets), 1, len(time_array) - 1)
+    left = targets - time_array[idx - 1]
+    right = time_array[idx] - targets
+    return idx - ((left < right) if latest else (left <= right))
+
+
+def _perievent_stats(
+    time: np.ndarray,
+    signal: np.ndarray,
+    raw_signal: np.ndarray,
+    start: np.ndarray,
+    event: np.ndarray,
+    end: np.ndarray,
+) -> dict:
+    """Compute the scalar perievent results of ``Session.analyze`` for many events of one recording at once.
+
+    :param time: timestamps of the recording
+    :param signal: normalized signal of the recording
+    :param raw_signal: raw signal of the recording
+    :param start: index of the start of each perievent window
+    :param event: index of each event
+    :param end: index of the end of each perievent window
+    :return: dictionnary of arrays, with one value per event (``NaN`` for events without any pre-event sample)
+
+    .. note::
+       Means and areas under curve are read from cumulative sums and integrals of the whole recording. As Z-scores
+       are affine transforms of the signal, their averages and areas under curve are derived from those of the
+       signal. Only the baseline statistics require the pre-event samples, gathered in a (padded) 2D array.
+       Results are computed in double precision, while ``Session.analyze`` works in single precision.
+    """
+    res = {k: np.full(len(start), np.nan) for k in _PERIEVENT_STATS}
+    # pre-event samples are [start, event - 1), post-event samples are [event, end]
+    # events too close to the recording start have no baseline and cannot be analyzed
+    analyzable = event - 1 > start
+    if not analyzable.any():
+        return res
+    start, event, end = start[analyzable], event[analyzable], end[analyzable]
+    pre_end = event - 1
+    post_end = end + 1
+    cumsum = np.concatenate(([0], np.cumsum(signal)))
+    cumAUC = integrate.cumulative_trapezoid(signal, x=time, initial=0)
+    cumAUC_raw = integrate.cumulative_trapezoid(raw_signal, x=time, initial=0)
+    pre_span = time[pre_end - 1] - time[start]
+    post_span = time[end] - time[event]
+
+    # baseline statistics, by chunks of events to bound the size of the padded array
+    mean, std, median, mad = (np.empty(len(start)) for _ in range(4))
+    offsets = np.arange((pre_end - start).max())
+    step = max(1, _BATCH_SIZE // len(offsets))
+    for i in range(0, len(start), step):
+        chunk = slice(i, i + step)
+        pre_idx = start[chunk, None] + offsets
+        baseline = np.where(
+            pre_idx < pre_end[chunk, None],
+            signal[np.minimum(pre_idx, len(signal) - 1)],
+            np.nan,
+        )
+        mean[chunk] = np.nanmean(baseline, axis=1)
+        std[chunk] = np.nanstd(baseline, axis=1)
+        median[chunk] = np.nanmedian(baseline, axis=1)
+        mad[chunk] = np.nanmedian(np.abs(baseline - median[chunk, None]), axis=1)
+    # baselines without spread cannot standardize the signal (see ``_baseline_stats``)
+    std[std == 0] = np.nan
+    mad[mad == 0] = np.nan
+
+    stats = {}
+    stats["sampling_rate"] = (end - start) / (time[end] - time[start])
+    stats["preAVG_dF"] = (cumsum[pre_end] - cumsum[start]) / (pre_end - start)
+    stats["postAVG_dF"] = (cumsum[post_end] - cumsum[event]) / (post_end - event)
+    stats["preAVG_Z"] = (stats["preAVG_dF"] - mean) / std
+    stats["postAVG_Z"] = (stats["postAVG_dF"] - mean) / std
+    stats["preAVG_RZ"] = (stats["preAVG_dF"] - median) / mad
+    stats["postAVG_RZ"] = (stats["postAVG_dF"] - median) / mad
+    stats["pre_raw_AUC"] = cumAUC_raw[pre_end - 1] - cumAUC_raw[start]
+    stats["post_raw_AUC"] = cumAUC_raw[end] - cumAUC_raw[event]
+    stats["preAUC"] = cumAUC[pre_end - 1] - cumAUC[start]
+    stats["postAUC"] = cumAUC[end] - cumAUC[event]
+    # the area under a single pre-event sample is 0, whatever its Z-score
+    single = pre_span == 0
+    stats["preZ_AUC"] = np.where(single, 0, (stats["preAUC"] - mean * pre_span) / std)
+    stats["postZ_AUC"] = (stats["postAUC"] - mean * post_span) / std
+    stats["preRZ_AUC"] = np.where(
+        single, 0, (stats["preAUC"] - median * pre_span) / mad
+    )
+    stats["postRZ_AUC"] = (stats["postAUC"] - median * post_span) / mad
+    for k, v in stats.items():
+        res[k][analyzable] = v
+    return res
+
+
+def _baseline_stats(baseline: np.ndarray) -> tuple:
+    """Compute the statistics used to standardize a perievent signal.
+
+    :param baseline: baseline signal (usually pre-event)
+    :return: mean, standard deviation, median and median absolute deviation of the baseline (deviations are
+             ``NaN`` rather than 0, as a baseline without spread cannot standardize a signal)
+
+    .. note::
+       Medians only need the middle samples, which ``np.partition`` places in linear time. The deviations to the
+       median are reused for both the median absolute deviation (unscaled, as ``scipy.stats.median_abs_deviation``)
+       and the (shifted, hence numerically stable) mean and variance.
+    """
+    n = len(baseline)
+    middle = [(n - 1) // 2, n // 2]
+    median = np.partition(baseline, middle)[middle].mean()
+    deviations = baseline - median
+    mean_deviation = deviations.sum() / n
+    std = np.sqrt(max((deviations * deviations).sum() / n - mean_deviation**2, 0))
+    absolute_deviations = np.abs(deviations)
+    absolute_deviations.partition(middle)
+    mad = absolute_deviations[middle].mean()
+    return median + mean_deviation, std or np.nan, median, mad or np.nan
+
+
 class Session(PyFiber):
     """Create object containing both fiber recordings and behavioral files.
 
@@ -82,6 +230,9 @@ class Session(PyFiber):
                 fiber, alignment=self.behavior.rec_start, verbosity=self._verbosity
             )
         self.analyses = {}
+        # non empty events and intervals shown by Session.plot, computed on first use
+        self._nonempty_events = None
+        self._nonempty_intervals = None
 
     def __repr__(self):
         """Representation of Session object."""
@@ -98,16 +249,15 @@ class Session(PyFiber):
         :param event_time: event of interest
         :param window: time window left and right of the event of interest
         :return: indices for the start, event and end of the sample, relative to the input array
+
+        .. note::
+           ``time_array`` is assumed to be sorted (as are fiber photometry timestamps), which allows a binary
+           search instead of a full scan. Each index is the one of the nearest timestamp.
         """
-        start = event_time - window[0]
-        end = event_time + window[1]
-        start_idx = np.where(abs(time_array - start) == min(abs(time_array - start)))[
-            0
-        ][0]
-        event_idx = np.where(
-            abs(time_array - event_time) == min(abs(time_array - event_time))
-        )[0][0]
-        end_idx = np.where(abs(time_array - end) == min(abs(time_array - end)))[0][-1]
+        start_idx, event_idx = _nearest(
+            time_array, [event_time - window[0], event_time]
+        ).tolist()
+        end_idx = int(_nearest(time_array, event_time + window[1], latest=True))
         return (start_idx, event_idx, end_idx)
 
     def _recorded_timestamps(
@@ -172,6 +322,10 @@ class Session(PyFiber):
 
         .. note::
            The normalization parameter correspond the process of taking into account the
+
+           Events without any pre-event sample (at the very start of a recording) cannot be analyzed and return
+           ``None``. Perievent signals are analyzed in single precision (see ``Analysis``), so results match those
+           of ``Session.analyze_many_events`` (double precision) to about 4 significant digits.
         """
         res = Analysis(self.ID)
         res.event_time = event_time
@@ -203,49 +357,72 @@ for {self.fiber.filepath},{self.behavior.filepath}"""
             res.window = self.perievent_window
         else:
             res.window = window
-        res.recordingdata = self.fiber.norm(
+        res.recordingdata = self.fiber._cached_norm(
             rec=res.rec_number, method=res.normalisation
         )
-        res.rawdata = self.fiber.norm(rec=res.rec_number, method="raw")
+        res.rawdata = self.fiber._cached_norm(rec=res.rec_number, method="raw")
+        # each column of the normalized data is a contiguous array (see ``Fiber.norm``)
+        time_array, signal_array = res.recordingdata.T
+        raw_signal_array, raw_control_array = res.rawdata.T[1:]
         start_idx, event_idx, end_idx = self._sample(
-            res.recordingdata[:, 0], event_time, res.window
+            time_array, event_time, res.window
         )
-        res.data = res.recordingdata[start_idx : end_idx + 1]
-        res.raw_signal = res.rawdata[start_idx : end_idx + 1][:, 1]
-        res.raw_control = res.rawdata[start_idx : end_idx + 1][:, 2]
-        res.signal = res.data[:, 1]
-        res.time = res.data[:, 0]
-        res.sampling_rate = 1 / np.diff(res.time).mean()
-        res.postevent = res.data[event_idx - start_idx :][:, 1]
-        res.pre_raw_sig = res.raw_signal[: event_idx - start_idx - 1]
-        res.pre_raw_ctrl = res.raw_control[: event_idx - start_idx - 1]
-        res.post_raw_sig = res.raw_signal[event_idx - start_idx :]
-        res.post_raw_ctrl = res.raw_control[event_idx - start_idx :]
-        res.post_time = res.data[event_idx - start_idx :][:, 0]
-        res.preevent = res.data[: event_idx - start_idx - 1][:, 1]
-        res.pre_time = res.data[: event_idx - start_idx - 1][:, 0]
-        res.zscores = (res.signal - res.preevent.mean()) / res.preevent.std()
-        res.pre_zscores = res.zscores[: event_idx - start_idx - 1]
-        res.post_zscores = res.zscores[event_idx - start_idx :]
-        res.rob_zscores = (
-            res.signal - np.median(res.preevent)
-        ) / stats.median_abs_deviation(res.preevent)
+        sample = slice(start_idx, end_idx + 1)
+        res.data = res.recordingdata[sample]
+        # signals are analyzed in single precision, timestamps keep double precision
+        res.raw_signal = raw_signal_array[sample].astype(np.float32)
+        res.raw_control = raw_control_array[sample].astype(np.float32)
+        res.signal = signal_array[sample].astype(np.float32)
+        res.time = time_array[sample]
+        # mean of the intersample intervals, without building the array of differences
+        res.sampling_rate = (
+            (len(res.time) - 1) / (res.time[-1] - res.time[0])
+            if len(res.time) > 1
+            else np.nan
+        )
+        # pre-event samples stop one sample before the event, post-event samples start at the event
+        event_pos = event_idx - start_idx
+        pre_end = event_pos - 1
+        if pre_end < 1:
+            self._print(
+                f"""\
+No pre-event sample at timestamp: {event_time}
+for {self.fiber.filepath},{self.behavior.filepath}"""
+            )
+            return None
+        mean, std, median, mad = _baseline_stats(res.signal[:pre_end])
+        res.zscores = np.subtract(res.signal, mean)
+        res.zscores /= std
+        res.rob_zscores = np.subtract(res.signal, median)
+        res.rob_zscores /= mad
+        for pre_name, post_name, perievent in [
+            ("preevent", "postevent", res.signal),
+            ("pre_time", "post_time", res.time),
+            ("pre_raw_sig", "post_raw_sig", res.raw_signal),
+            ("pre_raw_ctrl", "post_raw_ctrl", res.raw_control),
+            ("pre_zscores", "post_zscores", res.zscores),
+            ("pre_Rzscores", "post_Rzscores", res.rob_zscores),
+        ]:
+            res.__dict__[pre_name] = perievent[:pre_end]
+            res.__dict__[post_name] = perievent[event_pos:]
         res.preAVG_dF = res.preevent.mean()
         res.postAVG_dF = res.postevent.mean()
-        res.pre_Rzscores = res.rob_zscores[: event_idx - start_idx - 1]
-        res.post_Rzscores = res.rob_zscores[event_idx - start_idx :]
         res.preAVG_Z = res.pre_zscores.mean()
         res.postAVG_Z = res.post_zscores.mean()
         res.preAVG_RZ = res.pre_Rzscores.mean()
         res.postAVG_RZ = res.post_Rzscores.mean()
-        res.pre_raw_AUC = integrate.simpson(res.pre_raw_sig, x=res.pre_time)
-        res.post_raw_AUC = integrate.simpson(res.post_raw_sig, x=res.post_time)
-        res.preAUC = integrate.simpson(res.preevent, x=res.pre_time)
-        res.postAUC = integrate.simpson(res.postevent, x=res.post_time)
-        res.preZ_AUC = integrate.simpson(res.pre_zscores, x=res.pre_time)
-        res.postZ_AUC = integrate.simpson(res.post_zscores, x=res.post_time)
-        res.preRZ_AUC = integrate.simpson(res.pre_Rzscores, x=res.pre_time)
-        res.postRZ_AUC = integrate.simpson(res.post_Rzscores, x=res.post_time)
+        # all areas under curve are read from a single cumulative integration
+        # (relative to the event, so that timestamps can be in single precision too)
+        cumulative_AUC = integrate.cumulative_trapezoid(
+            np.column_stack((res.raw_signal, res.signal, res.zscores, res.rob_zscores)),
+            x=(res.time - event_time).astype(np.float32),
+            axis=0,
+            initial=0,
+        )
+        pre_AUC = cumulative_AUC[pre_end - 1]
+        post_AUC = cumulative_AUC[-1] - cumulative_AUC[event_pos]
+        res.pre_raw_AUC, res.preAUC, res.preZ_AUC, res.preRZ_AUC = pre_AUC
+        res.post_raw_AUC, res.postAUC, res.postZ_AUC, res.postRZ_AUC = post_AUC
         pre_peak_analysis = self.fiber.peakFA(
             res.event_time - res.window[0], res.event_time
         )
@@ -285,6 +462,84 @@ for {self.fiber.filepath},{self.behavior.filepath}"""
         )
         return res
 
+    def analyze_many_events(
+        self,
+        event_times: Events,
+        window: Union[str, tuple] = "default",
+        norm: str = "default",
+    ) -> dict:
+        """Return the scalar results of ``Session.analyze`` for many events, computed in batch.
+
+        :param event_times: timestamps of the events of interest
+        :param window: perievent analysis window
+        :param norm: normalization method
+        :return: dictionnary of arrays (one value per event, in input order) with event times, recording numbers,
+                 sampling rates, averages and areas under curve (see ``Analysis``)
+
+        .. note::
+           No ``Analysis`` object is created, and transient (peak) results are not included. Events outside of the
+           fiber recordings have a recording number of 0 and ``NaN`` results, and events without any pre-event
+           sample (at the very start of a recording) have ``NaN`` results: these are the events for which
+           ``Session.analyze`` returns ``None``. Results are computed in double precision, while ``Session.analyze``
+           works in single precision, so they match to about 4 significant digits. Use ``Session.analyze`` to
+           retrieve the full perievent data of a specific event.
+        """
+        if window == "default":
+            window = self.perievent_window
+        if norm == "default":
+            norm = self.default_norm
+        elif norm not in ["Z", "F"]:
+            self._print(
+                """Invalid choice for signal normalisation !
+                nZ-score differences: norm='Z'\ndelta F/f: stand='F'"""
+            )
+            return None
+        event_times = np.asarray(event_times, dtype=float)
+        rec_numbers = self.fiber._find_recs(event_times)
+        results = {"event_time": event_times, "rec_number": rec_numbers}
+        results.update(
+            {k: np.full(len(event_times), np.nan) for k in _PERIEVENT_STATS}
+        )
+        for rec in np.unique(rec_numbers[rec_numbers > 0]):
+            selected = rec_numbers == rec
+            times = event_times[selected]
+            recordingdata = self.fiber._cached_norm(rec=rec, method=norm)
+            rawdata = self.fiber._cached_norm(rec=rec, method="raw")
+            time_array = recordingdata[:, 0]
+            stats = _perievent_stats(
+                time_array,
+                recordingdata[:, 1],
+                rawdata[:, 1],
+                _nearest(time_array, times - window[0]),
+                _nearest(time_array, times),
+                _nearest(time_array, times + window[1], latest=True),
+            )
+            for k, v in stats.items():
+                results[k][selected] = v
+        return results
+
+    def analyze_events_table(
+        self,
+        event_times: Events,
+        window: Union[str, tuple] = "default",
+        norm: str = "default",
+    ) -> pd.DataFrame:
+        """Return the scalar perievent results of many events as a table, without creating ``Analysis`` objects.
+
+        :param event_times: timestamps of the events of interest
+        :param window: perievent analysis window
+        :param norm: normalization method
+        :return: data frame with one row per event (see ``Session.analyze_many_events`` for the columns)
+
+        .. note::
+           The table only holds scalar results. To plot the perievent data of a specific event, create its
+           ``Analysis`` object with ``Session.analyze``.
+        """
+        results = self.analyze_many_events(event_times, window=window, norm=norm)
+        if results is None:
+            return None
+        return pd.DataFrame(results)
+
     def update_window(self, new_window):
         """Change perievent window."""
         self.perievent_window = new_window
@@ -294,6 +549,8 @@ for {self.fiber.filepath},{self.behavior.filepath}"""
         self.recorded_intervals = self.behavior.intervals(
             recorded=True, window=self.perievent_window
         )
+        self._nonempty_events = None
+        self._nonempty_intervals = None
 
     def plot(self, what="events"):
         """Plot either events or intervals.
@@ -301,11 +558,24 @@ for {self.fiber.filepath},{self.behavior.filepath}"""
         Tests if they happen within recording timeframe.
         """
         if what == "events":
-            data = {k: v for k, v in self.analyzable_events.items() if v.size > 0}
+            if self._nonempty_events is None:
+                events = self.behavior.events(
+                    recorded=True, window=self.perievent_window
+                )
+                self._nonempty_events = {k: v for k, v in events.items() if len(v)}
+            data = self._nonempty_events
         elif what == "intervals":
-            data = {k: v for k, v in self.recorded_intervals.items() if v.size > 0}
+            if self._nonempty_intervals is None:
+                intervals = self.behavior.intervals(
+                    recorded=True, window=self.perievent_window
+                )
+                self._nonempty_intervals = {
+                    k: v for k, v in intervals.items() if len(v)
+                }
+            data = self._nonempty_intervals
         else:
             self._print("Choose either 'intervals' or 'events'")
+            return
         self.behavior.figure(obj=list(data.values()), label_list=list(data.keys()))
 
 
@@ -363,6 +633,13 @@ class Analysis(PyFiber):
     :ivar pre_peak_frequency: pre-event transient frequency
     :ivar pre_peak_max_Z: pre-event maximum Z-scores of transients
     :ivar pre_peak_max_dFF: pre-event maximum amplitude of transients
+
+    .. note::
+       Peri-event signals (and the values computed from them) are single precision (``float32``), which is well
+       above the precision of the recorded signal: scalar results (averages, areas under curve) are ``np.float32``
+       rather than Python floats. Timestamps keep double precision.
+       ``recordingdata``, ``rawdata``, ``data`` and ``time`` are read-only views of the normalized recordings,
+       which are shared by all the analyses of a session: copy them before modifying them.
     """
 
     _savgol = PyFiber._savgol
@@ -404,18 +681,16 @@ class Analysis(PyFiber):
         By default smoothes data with Savitski Golay filter
         (window size 250ms).
         """
-        try:
-            data = self.__dict__[data]
-        except KeyError:
+        if data not in self.__dict__:
             self._print(
                 f"""Input type should be a string, possible inputs:
                     {self._possible_data()}"""
             )
+            return
+        data = self.__dict__[data]
         time = self.time
         if smooth:
-            time_and_data = self.smooth(data, method=smth_method, window=smth_window)
-            s_time = time_and_data[:, 0]
-            s_data = time_and_data[:, 1]
+            s_time, s_data = self.smooth(data, method=smth_method, window=smth_window)
         if len(data) == len(time):
             plt.figure(figsize=figsize)
             if show_non_smoothed:
@@ -437,9 +712,14 @@ class Analysis(PyFiber):
             plt.show()
 
     def _possible_data(self):
-        d = {k: v for k, v in self.__dict__.items() if isinstance(v, np.ndarray)}
-        matching_arrays = [f"'{k}'" for k in d.keys() if d[k].shape == self.time.shape]
-        return "\n".join(matching_arrays)
+        # the perievent arrays do not change once analyzed, so their names are only looked up once
+        if "_plottable" not in self.__dict__:
+            self._plottable = tuple(
+                k
+                for k, v in self.__dict__.items()
+                if isinstance(v, np.ndarray) and v.shape == self.time.shape
+            )
+        return "\n".join(f"'{k}'" for k in self._plottable)
 
     def smooth(
         self, data, method="savgol", window="default", polyorder=3, add_time=True
@@ -449,6 +729,8 @@ class Analysis(PyFiber):
         Possible methods:
             - Savitsky-Golay filter
             - rolling average.
+
+        :return: smoothed data, or a tuple of timestamps and smoothed data arrays if ``add_time`` is ``True``
         """
         if isinstance(data, str):
             data = self.__dict__[data]
@@ -460,22 +742,17 @@ class Analysis(PyFiber):
         if method == "savgol":
             smoothed = self._savgol(data, window, polyorder)
             if add_time:
-                return np.vstack((self.time, smoothed)).T
+                return self.time, smoothed
         if method == "rolling":
-            smoothed = (
-                pd.Series(data).rolling(window=window).mean().iloc[window - 1 :].values
-            )
+            window = int(window)
+            # keeping only complete windows of the centered filter gives a trailing rolling mean
+            complete = slice(window // 2, window // 2 + len(data) - window + 1)
+            smoothed = ndimage.uniform_filter1d(data, size=window)[complete]
             if add_time:
-                return np.vstack(
-                    (
-                        pd.Series(self.time)
-                        .rolling(window=window)
-                        .mean()
-                        .iloc[window - 1 :]
-                        .values,
-                        smoothed,
-                    )
-                ).T
+                return (
+                    ndimage.uniform_filter1d(self.time, size=window)[complete],
+                    smoothed,
+                )
         return smoothed
 
 
@@ -104,7 +104,13 @@ def detect_peaks(
     t_points = np.arange(time[0], time[-1], window)
     if t_points[-1] != time[-1]:
         t_points = np.concatenate((t_points, [time[-1]]))
-    indexes = [np.where(abs(time - i) == abs(time - i).min())[0][0] for i in t_points]
+    # nearest sample of each point, reusing a single buffer for the distances
+    distances = np.empty(len(time))
+    indexes = []
+    for i in t_points:
+        np.subtract(time, i, out=distances)
+        np.abs(distances, out=distances)
+        indexes.append(distances.argmin())
 
     # create time bins
     bins = [
@@ -327,8 +333,19 @@ class Fiber(PyFiber):
             )
             for recording in range(1, self.number_of_recording + 1)
         ]
+        self._rec_numbers = np.array(list(self.recordings.keys()), dtype=int)
+        # reshaped so that a file without recordings gives empty arrays
+        self._rec_starts, self._rec_ends = (
+            np.array(
+                [v["time"].to_numpy()[[0, -1]] for v in self.recordings.values()],
+                dtype=float,
+            )
+            .reshape(-1, 2)
+            .T
+        )
 
         # ANALYZE PEAKS FOR EACH RECORDING
+        self._norm_cache = {}
         self.peaks = {}
         self._print("Analyzing peaks...")
         for r in self.recordings.keys():
@@ -359,15 +376,27 @@ Aligned to behavior file : {self.alignment} s
         """Find recording number corresponding to inputed timestamp.
 
         :param timestamp: timestamp of which to find the recording number if any"""
-        rec_num = self.number_of_recording
-        time_nom = "time"
-        return [
-            i
-            for i in range(1, rec_num + 1)
-            if self.get(time_nom, recording=i)[0]
-            <= timestamp
-            <= self.get(time_nom, recording=i)[-1]
-        ]
+        rec = self._find_recs(timestamp)
+        return [int(rec)] if rec else []
+
+    def _find_recs(self, timestamps: Union[float, np.ndarray]) -> np.ndarray:
+        """Find recording numbers corresponding to inputed timestamps, 0 if not recorded.
+
+        :param timestamps: timestamps of which to find the recording numbers
+
+        .. note::
+           Recordings are sorted and do not overlap, so each timestamp is located with a binary search on the
+           recording start times.
+        """
+        timestamps = np.asarray(timestamps, dtype=float)
+        if not len(self._rec_starts):
+            return np.zeros(timestamps.shape, dtype=int)
+        idx = np.searchsorted(self._rec_starts, timestamps, side="right") - 1
+        idx = np.maximum(idx, 0)
+        recorded = (self._rec_starts[idx] <= timestamps) & (
+            timestamps <= self._rec_ends[idx]
+        )
+        return np.where(recorded, self._rec_numbers[idx], 0)
 
     def _read_file(self, filepath, alignment=0) -> pd.DataFrame:
         """Read file and align the timestamps if specified.
@@ -595,6 +624,8 @@ Aligned to behavior file : {self.alignment} s
         .. _n:
         .. note::
            This method is a wrapper of the ``fiber.normalize_signal`` function, see its documentation for more details.
+           With ``add_time``, the output is stored column by column (Fortran order), so that time, signal and control
+           columns are each contiguous in memory.
         """
         sig = self.get("signal", rec)
         ctrl = self.get("control", rec)
@@ -607,10 +638,31 @@ Aligned to behavior file : {self.alignment} s
         else:
             normalized = normalize_signal(signal=sig, control=ctrl, method=method)
         if add_time:
+            # transposing the stacked rows gives contiguous columns
             return np.vstack((tm, normalized)).T
         else:
             return normalized
 
+    def _cached_norm(self, rec: int = 1, method: str = "default") -> np.ndarray:
+        """Return normalized data with timestamps, computing it only once per recording and method.
+
+        :param rec: recording number
+        :param method: normalization method (see ``Fiber.norm``)
+
+        .. note::
+           The returned array is shared between callers (and ``Analysis`` objects), so it is read-only: copy it
+           before modifying it. The cache is filled by perievent analyses only, and is kept as long as the
+           ``Fiber`` object.
+        """
+        if method == "default":
+            method = self.default_norm
+        key = (rec, method)
+        if key not in self._norm_cache:
+            normalized = self.norm(rec=rec, method=method, add_time=True)
+            normalized.flags.writeable = False
+            self._norm_cache[key] = normalized
+        return self._norm_cache[key]
+
     def _detect_peaks(
         self,
         rec=False,
@@ -1,4 +1,6 @@
 import unittest
+import numpy as np
+from scipy import integrate, stats
 from src.pyfiber._utils import PyFiber
 from src.pyfiber import *
 
@@ -18,5 +20,89 @@ class TestSimple(unittest.TestCase):
                          len(Fiber(test_data+'fiber2.csv').df))
 
 
+class TestAnalysis(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.session = Session(test_data+'behavior1.dat', test_data+'fiber1.csv',
+                              verbosity=False)
+        cls.window = (5, 5)
+        start, end = cls.session.fiber.rec_intervals[0]
+        # recorded timestamps, then one before the recording
+        cls.timestamps = np.concatenate((np.linspace(start+10, end-10, 25),
+                                         [start - 100]))
+
+    def test_sample_single_timestamp(self):
+        self.assertEqual(self.session._sample(np.array([10.]), 10., self.window), (0, 0, 0))
+
+    def test_analyze_many_events(self):
+        batch = self.session.analyze_many_events(self.timestamps, window=self.window)
+        analyses = [self.session.analyze(t, window=self.window)
+                    for t in self.timestamps]
+        self.assertIsNone(analyses[-1])
+        self.assertEqual(batch['rec_number'][-1], 0)
+        for k in batch:
+            if k in ['event_time', 'rec_number']:
+                continue
+            self.assertTrue(np.isnan(batch[k][-1]))
+            np.testing.assert_allclose(batch[k][:-1],
+                                       [getattr(a, k) for a in analyses[:-1]],
+                                       rtol=1e-4, atol=1e-5, err_msg=k)
+
+    def test_analyze_many_events_on_edges(self):
+        # events on the first samples of a recording: without any baseline sample,
+        # then with baselines of one or two samples (without spread)
+        window = (1, 2)
+        time = self.session.fiber.get('time', 1)
+        timestamps = time[:6]
+        batch = self.session.analyze_many_events(timestamps, window=window)
+        with np.errstate(all='ignore'):
+            analyses = [self.session.analyze(t, window=window) for t in timestamps]
+        self.assertIsNone(analyses[0])
+        for k in batch:
+            if k in ['event_time', 'rec_number']:
+                continue
+            for i, a in enumerate(analyses):
+                if a is None:
+                    self.assertTrue(np.isnan(batch[k][i]), msg=k)
+                else:
+                    np.testing.assert_allclose(batch[k][i], getattr(a, k), rtol=1e-4,
+                                               atol=1e-5, equal_nan=True, err_msg=k)
+
+    def test_analyze_events_table(self):
+        table = self.session.analyze_events_table(self.timestamps, window=self.window)
+        batch = self.session.analyze_many_events(self.timestamps, window=self.window)
+        self.assertEqual(len(table), len(self.timestamps))
+        self.assertEqual(list(table.columns), list(batch.keys()))
+        for k, v in batch.items():
+            np.testing.assert_array_equal(table[k].to_numpy(), v)
+
+    def test_shared_recordings_read_only(self):
+        res = self.session.analyze(self.timestamps[0], window=self.window)
+        expected = self.session.analyze(self.timestamps[1], window=self.window).postAUC
+        with self.assertRaises(ValueError):
+            res.data[:, 1] *= 10
+        self.assertEqual(self.session.analyze(self.timestamps[1], window=self.window).postAUC,
+                         expected)
+
+    def test_single_precision(self):
+        res = self.session.analyze(self.timestamps[0], window=self.window)
+        self.assertIsInstance(res.postZ_AUC, np.float32)
+        # float64 reference computed from the peri-event data
+        time, signal = res.data.T
+        pre, post = slice(0, len(res.pre_time)), slice(-len(res.post_time), None)
+        baseline = signal[pre]
+        zscores = (signal - baseline.mean()) / baseline.std()
+        rob_zscores = ((signal - np.median(baseline))
+                       / stats.median_abs_deviation(baseline))
+        for name, values in [('Z', zscores), ('RZ', rob_zscores)]:
+            for period, part in [('pre', pre), ('post', post)]:
+                self.assertAlmostEqual(getattr(res, f'{period}AVG_{name}'),
+                                       values[part].mean(), places=4)
+                self.assertAlmostEqual(getattr(res, f'{period}{name}_AUC'),
+                                       integrate.trapezoid(values[part], time[part]),
+                                       places=4)
+
+
 if __name__ == '__main__':
-    unittest.main()
\ No newline at end of file
+    unittest.main()